@@ -4,53 +4,257 @@ FINAL PATH: /etc/secrets/nortiq-forms-65b5a63e6217.json
 UPDATED: Resend API for FAST email (no SMTP timeout)
 """
 from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import json
-from datetime import datetime
+import functools
+import itertools
+import hashlib
+import hmac
+import threading
+import atexit
+from queue import SimpleQueue, Empty
+from collections import OrderedDict
+import logging
+import logging.handlers
+from pathlib import Path
+from string import Template
+from html import escape
 import time
+import random
+
+# Logging - level from LOG_LEVEL env var (WARNING in production).
+# Handlers only enqueue records; a listener thread does the blocking write
+# to the Render log pipe, so request threads never wait on stderr
+_log_queue = SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter())  # message only - _log_handler adds level and name
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING').upper(), handlers=[_queue_handler])
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # registered first, so it stops last and drains every record
+logger = logging.getLogger('forms')
+
+# Try to import orjson (fast JSON) - fall back to stdlib json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.info("orjson not installed - using stdlib json")
 
 # Try to import Resend
 try:
     import resend
+    import requests
     RESEND_AVAILABLE = True
 except ImportError:
     RESEND_AVAILABLE = False
-    print("Note: resend not installed - install with: pip install resend")
+    logger.warning("resend not installed - install with: pip install resend")
 
 # Try to import Google Sheets
 try:
     import gspread
     from google.oauth2.service_account import Credentials
+    from google.auth.exceptions import RefreshError
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     SHEETS_AVAILABLE = True
 except ImportError:
     SHEETS_AVAILABLE = False
-    print("Note: gspread not installed - Google Sheets disabled")
+    logger.warning("gspread not installed - Google Sheets disabled")
+
+_iso_cache = (None, '')  # (epoch second, formatted) - swapped as one tuple
+
+def iso_now(now=None):
+    """Local time as YYYY-MM-DDTHH:MM:SS - formatted at most once per second, no datetime object"""
+    global _iso_cache
+    second = int(time.time() if now is None else now)
+    cached_second, text = _iso_cache
+    if second != cached_second:
+        text = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second))
+        _iso_cache = (second, text)
+    return text
+
+def json_loads(data):
+    """Parse JSON (str or bytes) with orjson if available, else stdlib json"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson - used by request.json and jsonify"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the Response - no str decode/re-encode
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+# Try to import Flask-Compress (br/gzip responses) - optional
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
+    logger.info("flask-compress not installed - responses sent uncompressed")
+
+# Try to import Celery (durable email queue) - optional
+try:
+    from celery import Celery
+    CELERY_AVAILABLE = True
+except ImportError:
+    CELERY_AVAILABLE = False
+    logger.info("celery not installed - emails sent inline")
 
 app = Flask(__name__)
-CORS(app)
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
+if COMPRESS_AVAILABLE:
+    # br/gzip for the larger JSON bodies (/, /test, /debug, /check-creds, /submit) -
+    # the tiny /ping and /health bodies stay under the threshold
+    app.config['COMPRESS_MIN_SIZE'] = 256
+    Compress(app)
+
+# Bodies over 16 KB are refused with 413 before anything is read or parsed
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024
 
 # Environment variables - GET FROM ENV VARS
 RESEND_API_KEY = os.getenv("RESEND_API_KEY", "")  # ⬅️ Set in Render env vars
 GOOGLE_SHEET_KEY = os.getenv("GOOGLE_SHEET_KEY", "")
+GOOGLE_CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON", "")  # Fallback when no secret file
+REDIS_URL = os.getenv("REDIS_URL", "")  # Celery broker - emails queued when set
+
+# Timeout (seconds) for every outbound Sheets / Resend call - a hung remote fails fast
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+
+# Admin - shared secret for /reload, the route answers 404 when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 # Email settings
 FROM_EMAIL = "onboarding@resend.dev"  # Default Resend domain
 # OR use your verified domain: "noreply@yourdomain.com"
 
+# Confirmation email - template compiled once at import ($name is substituted per send)
+EMAIL_SUBJECT = "本日のブース訪問、ありがとうございます / Thanks for visiting our booth today!"
+EMAIL_FROM = f"Kyowa Technologies <{FROM_EMAIL}>"
+EMAIL_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'email.html')
+with open(EMAIL_TEMPLATE_PATH, 'r', encoding='utf-8') as f:
+    EMAIL_TEMPLATE = Template(f.read())
+# Pre-rendered when the template has no placeholders - then only "to" varies per send.
+# Scans with Template.pattern directly - get_identifiers() is Python 3.11+ only
+EMAIL_HAS_PLACEHOLDERS = any(
+    m.group('named') or m.group('braced')
+    for m in EMAIL_TEMPLATE.pattern.finditer(EMAIL_TEMPLATE.template)
+)
+EMAIL_HTML_STATIC = None if EMAIL_HAS_PLACEHOLDERS else EMAIL_TEMPLATE.safe_substitute()
+EMAIL_PAYLOAD_BASE = {"from": EMAIL_FROM, "subject": EMAIL_SUBJECT}
+
+# Feature flags - env vars and imports never change after boot, evaluate once
+EMAIL_ENABLED = bool(RESEND_AVAILABLE and RESEND_API_KEY)
+SHEETS_ENABLED = bool(SHEETS_AVAILABLE and GOOGLE_SHEET_KEY)
+
 # Initialize Resend if available
-if RESEND_AVAILABLE and RESEND_API_KEY:
+if EMAIL_ENABLED:
     resend.api_key = RESEND_API_KEY
-    print(f"✅ Resend API initialized with key: {RESEND_API_KEY[:10]}...")
+    logger.info("✅ Resend API initialized with key: %s...", RESEND_API_KEY[:10])
 elif RESEND_AVAILABLE and not RESEND_API_KEY:
-    print("⚠️ Resend library available but RESEND_API_KEY not set in environment")
+    logger.warning("⚠️ Resend library available but RESEND_API_KEY not set in environment")
 
 # FINAL credentials file path - EXACT PATH
 CREDENTIALS_FILE_PATH = "/etc/secrets/nortiq-forms-65b5a63e6217.json"
+REQUIRED_CREDENTIAL_FIELDS = frozenset({'type', 'project_id', 'private_key_id', 'private_key', 'client_email'})
 
-@app.route('/')
-def home():
-    return jsonify({
+# Google Sheets OAuth - service account credentials parsed once at boot
+SHEETS_SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+SHEET_HEADERS = ['Full Name', 'Desired Position', 'Desired Year', 'Interests', 'Comments', 'Timestamp']
+SHEET_ROW_FIELDS = ('fullName', 'desiredPosition', 'desiredYear', 'interests', 'comments')  # form keys, in column order
+_OAUTH_CREDS = None
+_headers_initialized = False
+
+# Hints for common Sheets errors - keyed by lowercase substring of the error
+SHEETS_ERROR_HINTS = {
+    'invalid_grant': ("🔑 ERROR: Invalid JWT Signature", "💡 Solution: Regenerate credentials or check time sync"),
+    'permission_denied': ("🔑 ERROR: Permission denied", "💡 Solution: Share sheet with: %s"),
+    'not found': ("🔑 ERROR: Sheet not found", "💡 Solution: Check GOOGLE_SHEET_KEY environment variable"),
+}
+
+# Google Sheets write buffer - rows are batched into one append_rows call
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", "2"))  # seconds
+SHEETS_FLUSH_SIZE = int(os.getenv("SHEETS_FLUSH_SIZE", "20"))  # rows
+SHEETS_MAX_BACKOFF = 60  # seconds between retries of a failed flush - one quota minute
+SHEETS_MAX_ATTEMPTS = 5  # then the batch is logged and dropped
+# One values.append POST per batch - INSERT_ROWS anchored at A1, no prior GET
+SHEETS_APPEND_OPTIONS = {
+    'value_input_option': 'RAW',
+    'insert_data_option': 'INSERT_ROWS',
+    'table_range': 'A1'
+}
+_row_queue = SimpleQueue()
+_flusher_lock = threading.Lock()
+_flusher_threads = {}
+_flushers_stopping = threading.Event()  # set on shutdown - cuts retry backoff short
+# Shutdown join - one final flush is an append plus at most one reopen-and-append
+FLUSHER_JOIN_TIMEOUT = 2 * REQUEST_TIMEOUT + 5
+
+# Outcome of one flush / batch send
+FLUSH_OK = 'ok'
+FLUSH_RETRY = 'retry'        # 429, 5xx or no response - back off and try again
+FLUSH_REJECTED = 'rejected'  # 400/422 - something in the payload is invalid
+FLUSH_FAILED = 'failed'      # any other error - retrying the same payload will not help
+
+def flush_outcome(status):
+    """FLUSH_RETRY for 429/5xx, FLUSH_REJECTED for 400/422, FLUSH_FAILED for any other HTTP error status"""
+    if status == 429 or status >= 500:
+        return FLUSH_RETRY
+    if status in (400, 422):
+        return FLUSH_REJECTED
+    return FLUSH_FAILED
+
+@functools.lru_cache(maxsize=1)
+def _credentials_file_exists(ttl_bucket):
+    return os.path.exists(CREDENTIALS_FILE_PATH)
+
+def credentials_file_exists():
+    """Cached os.path.exists(CREDENTIALS_FILE_PATH) - re-checked at most every 60s"""
+    return _credentials_file_exists(int(time.monotonic() // 60))
+
+# (st_mtime_ns, bytes, parsed dict or None) - swapped as one tuple so readers never mix versions
+_creds_file_cache = (None, None, None)
+
+def _credentials_file_entry():
+    """Cache entry for the credentials file - re-read only when its mtime changes"""
+    global _creds_file_cache
+    mtime = os.stat(CREDENTIALS_FILE_PATH).st_mtime_ns
+    entry = _creds_file_cache
+    if entry[0] != mtime:
+        entry = _creds_file_cache = (mtime, Path(CREDENTIALS_FILE_PATH).read_bytes(), None)
+    return entry
+
+def read_credentials_file():
+    """Credentials file as bytes - shared by /debug, /check-creds and load_credentials"""
+    return _credentials_file_entry()[1]
+
+def parse_credentials_file():
+    """Credentials file as a dict - decoded once per file version, raises on invalid JSON"""
+    global _creds_file_cache
+    entry = _credentials_file_entry()
+    if entry[2] is None:
+        entry = _creds_file_cache = (entry[0], entry[1], json_loads(entry[1]))
+    return entry[2]
+
+@functools.lru_cache(maxsize=2)
+def _home_body(file_exists):
+    """Serialized / response - config is fixed for the process, only file_exists can change"""
+    return app.json.dumps({
         'status': 'ok',
         'service': 'Form Submission Backend - FINAL',
         'config': {
@@ -59,26 +263,34 @@ def home():
             'google_sheets': bool(GOOGLE_SHEET_KEY),
             'credentials_file': 'nortiq-forms-65b5a63e6217.json',
             'credentials_path': CREDENTIALS_FILE_PATH,
-            'file_exists': os.path.exists(CREDENTIALS_FILE_PATH) if SHEETS_AVAILABLE else 'N/A',
+            'file_exists': file_exists,
             'sheets_library': 'AVAILABLE' if SHEETS_AVAILABLE else 'NOT AVAILABLE'
         },
+        # /reload is left out on purpose - it is admin-only and 404s without the token
         'endpoints': ['/', '/ping', '/health', '/test', '/debug', '/check-creds', '/submit']
-    })
+    }) + '\n'
 
+@app.route('/')
+def home():
+    file_exists = credentials_file_exists() if SHEETS_AVAILABLE else 'N/A'
+    return app.response_class(_home_body(file_exists), mimetype='application/json')
+
+# Health-check bodies are formatted directly - no dict or JSON encode per probe
 @app.route('/ping')
 def ping():
-    return jsonify({'pong': True, 'time': datetime.now().isoformat(), 'timestamp': time.time()})
+    now = time.time()
+    body = f'{{"pong":true,"time":"{iso_now(now)}","timestamp":{now!r}}}\n'
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/health')
 def health():
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    body = f'{{"status":"healthy","timestamp":"{iso_now()}"}}\n'
+    return app.response_class(body, mimetype='application/json')
 
-@app.route('/test')
-def test():
-    """Check configuration"""
-    creds_file_exists = os.path.exists(CREDENTIALS_FILE_PATH) if SHEETS_AVAILABLE else False
-    
-    return jsonify({
+@functools.lru_cache(maxsize=2)
+def _test_body_prefix(creds_file_exists):
+    """Serialized /test response minus its closing brace - server_time is appended per request"""
+    return app.json.dumps({
         'resend_api_key': 'SET' if RESEND_API_KEY else 'NOT SET',
         'resend_library': 'AVAILABLE' if RESEND_AVAILABLE else 'NOT AVAILABLE',
         'google_sheet_key': 'SET' if GOOGLE_SHEET_KEY else 'NOT SET',
@@ -86,9 +298,15 @@ def test():
         'credentials_path': CREDENTIALS_FILE_PATH,
         'file_exists': creds_file_exists,
         'file_exists_detail': 'YES' if creds_file_exists else 'NO - Check Render Secret Files',
-        'sheets_library': 'AVAILABLE' if SHEETS_AVAILABLE else 'NOT AVAILABLE',
-        'server_time': datetime.now().isoformat()
-    })
+        'sheets_library': 'AVAILABLE' if SHEETS_AVAILABLE else 'NOT AVAILABLE'
+    })[:-1]
+
+@app.route('/test')
+def test():
+    """Check configuration"""
+    creds_file_exists = credentials_file_exists() if SHEETS_AVAILABLE else False
+    body = f'{_test_body_prefix(creds_file_exists)},"server_time":"{iso_now()}"}}\n'
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/debug')
 def debug():
@@ -96,42 +314,41 @@ def debug():
     debug_info = {
         'credentials_file': 'nortiq-forms-65b5a63e6217.json',
         'credentials_path': CREDENTIALS_FILE_PATH,
-        'file_exists': os.path.exists(CREDENTIALS_FILE_PATH),
+        'file_exists': credentials_file_exists(),
         'sheets_available': SHEETS_AVAILABLE,
         'resend_available': RESEND_AVAILABLE,
-        'resend_initialized': bool(RESEND_AVAILABLE and RESEND_API_KEY),
+        'resend_initialized': EMAIL_ENABLED,
         'resend_key_set': bool(RESEND_API_KEY),
         'resend_key_preview': RESEND_API_KEY[:8] + '...' if RESEND_API_KEY and len(RESEND_API_KEY) > 8 else 'N/A',
         'server_time': time.time(),
         'render_environment': bool(os.getenv('RENDER'))
     }
     
-    if os.path.exists(CREDENTIALS_FILE_PATH):
+    if credentials_file_exists():
         try:
-            with open(CREDENTIALS_FILE_PATH, 'r') as f:
-                content = f.read()
-                debug_info['file_size'] = len(content)
-                debug_info['file_readable'] = True
+            content = read_credentials_file()
+            debug_info['file_size'] = len(content)
+            debug_info['file_readable'] = True
+            
+            # Try to parse as JSON
+            try:
+                creds = parse_credentials_file()
+                debug_info['json_valid'] = True
+                debug_info['service_account'] = creds.get('client_email', 'Not found')
+                debug_info['project_id'] = creds.get('project_id', 'Not found')
+                debug_info['private_key_id'] = creds.get('private_key_id', 'Not found')
+                debug_info['key_type'] = creds.get('type', 'Not found')
+                
+                # Check private key
+                private_key = creds.get('private_key', '')
+                if private_key:
+                    debug_info['private_key_length'] = len(private_key)
+                    debug_info['private_key_has_newlines'] = '\n' in private_key
+                    debug_info['private_key_starts_with'] = private_key[:30]
+            except json.JSONDecodeError as e:
+                debug_info['json_valid'] = False
+                debug_info['json_error'] = str(e)
                 
-                # Try to parse as JSON
-                try:
-                    creds = json.loads(content)
-                    debug_info['json_valid'] = True
-                    debug_info['service_account'] = creds.get('client_email', 'Not found')
-                    debug_info['project_id'] = creds.get('project_id', 'Not found')
-                    debug_info['private_key_id'] = creds.get('private_key_id', 'Not found')
-                    debug_info['key_type'] = creds.get('type', 'Not found')
-                    
-                    # Check private key
-                    private_key = creds.get('private_key', '')
-                    if private_key:
-                        debug_info['private_key_length'] = len(private_key)
-                        debug_info['private_key_has_newlines'] = '\n' in private_key
-                        debug_info['private_key_starts_with'] = private_key[:30]
-                except json.JSONDecodeError as e:
-                    debug_info['json_valid'] = False
-                    debug_info['json_error'] = str(e)
-                    
         except Exception as e:
             debug_info['file_readable'] = False
             debug_info['file_error'] = str(e)
@@ -145,9 +362,9 @@ def debug():
 def check_credentials():
     """Verify FINAL credentials file"""
     try:
-        print(f"🔍 Checking credentials at: {CREDENTIALS_FILE_PATH}")
+        logger.debug("🔍 Checking credentials at: %s", CREDENTIALS_FILE_PATH)
         
-        if not os.path.exists(CREDENTIALS_FILE_PATH):
+        if not credentials_file_exists():
             return jsonify({
                 'status': 'error',
                 'message': 'File not found at exact path',
@@ -155,10 +372,9 @@ def check_credentials():
                 'instruction': 'Upload to Render → Environment → Secret Files with exact mount path'
             }), 404
         
-        with open(CREDENTIALS_FILE_PATH, 'r') as f:
-            content = f.read()
-            print(f"📄 File size: {len(content)} bytes")
-            creds = json.loads(content)
+        content = read_credentials_file()
+        logger.debug("📄 File size: %s bytes", len(content))
+        creds = parse_credentials_file()
         
         # Extract key details
         private_key = creds.get('private_key', '')
@@ -181,7 +397,7 @@ def check_credentials():
         })
         
     except json.JSONDecodeError as e:
-        print(f"❌ JSON Parse Error: {e}")
+        logger.error("❌ JSON Parse Error: %s", e)
         return jsonify({
             'status': 'error',
             'message': 'Invalid JSON format',
@@ -189,7 +405,7 @@ def check_credentials():
             'file_path': CREDENTIALS_FILE_PATH
         }), 500
     except Exception as e:
-        print(f"❌ Error: {e}")
+        logger.error("❌ Error: %s", e)
         return jsonify({
             'status': 'error',
             'message': str(e),
@@ -197,275 +413,652 @@ def check_credentials():
             'file_path': CREDENTIALS_FILE_PATH
         }), 500
 
-def load_credentials():
-    """Load credentials from EXACT path"""
-    print(f"📂 Loading from: {CREDENTIALS_FILE_PATH}")
+@app.route('/reload', methods=['POST'])
+def reload_credentials():
+    """Drop cached credential file state after rotating the secret - needs X-Admin-Token"""
+    global _OAUTH_CREDS, _creds_file_cache
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'status': 'error', 'message': 'Not found'}), 404
+    
+    _credentials_file_exists.cache_clear()
+    _creds_file_cache = (None, None, None)
+    _parse_credentials.cache_clear()
+    _OAUTH_CREDS = None
+    if SHEETS_AVAILABLE:
+        _reset_worksheet()
+    logger.info("♻️ Credentials caches cleared via /reload")
     
-    if not os.path.exists(CREDENTIALS_FILE_PATH):
-        print(f"❌ File not found: {CREDENTIALS_FILE_PATH}")
-        print("💡 Upload to Render → Environment → Secret Files")
-        print(f"💡 Mount Path: {CREDENTIALS_FILE_PATH}")
+    return jsonify({
+        'status': 'success',
+        'message': 'Credential caches cleared - next Sheets flush re-authorizes',
+        'file_exists': credentials_file_exists(),
+        'server_time': iso_now()
+    })
+
+def load_credentials():
+    """Parsed credentials dict - parsed once per process, failures are not cached"""
+    credentials = _parse_credentials()
+    if credentials is None:
+        _parse_credentials.cache_clear()
+    return credentials
+
+@functools.lru_cache(maxsize=1)
+def _parse_credentials():
+    """Load credentials from EXACT path (or GOOGLE_CREDENTIALS_JSON if no file)"""
+    if credentials_file_exists():
+        logger.debug("📂 Loading from: %s", CREDENTIALS_FILE_PATH)
+        source = CREDENTIALS_FILE_PATH
+    elif GOOGLE_CREDENTIALS_JSON:
+        logger.debug("📂 Loading from GOOGLE_CREDENTIALS_JSON env var")
+        source = 'GOOGLE_CREDENTIALS_JSON'
+    else:
+        logger.error("❌ File not found: %s", CREDENTIALS_FILE_PATH)
+        logger.error("💡 Upload to Render → Environment → Secret Files")
+        logger.error("💡 Mount Path: %s", CREDENTIALS_FILE_PATH)
         return None
     
     try:
-        with open(CREDENTIALS_FILE_PATH, 'r') as f:
-            credentials = json.load(f)
-        
-        # Verify required fields
-        required = ['type', 'project_id', 'private_key_id', 'private_key', 'client_email']
-        missing = [field for field in required if field not in credentials]
+        if source == CREDENTIALS_FILE_PATH:
+            credentials = parse_credentials_file()
+        else:
+            credentials = json_loads(GOOGLE_CREDENTIALS_JSON)
         
-        if missing:
-            print(f"❌ Missing fields: {missing}")
+        # Verify required fields - one subset test, the missing list is only built on failure
+        if not REQUIRED_CREDENTIAL_FIELDS <= credentials.keys():
+            logger.error("❌ Missing fields: %s", sorted(REQUIRED_CREDENTIAL_FIELDS - credentials.keys()))
             return None
         
-        print(f"✅ Loaded credentials for: {credentials.get('client_email', 'Unknown')}")
+        logger.debug("✅ Loaded credentials for: %s", credentials.get('client_email', 'Unknown'))
         return credentials
         
     except Exception as e:
-        print(f"❌ Error reading {CREDENTIALS_FILE_PATH}: {e}")
+        logger.error("❌ Error reading %s: %s", source, e)
         return None
 
-def save_to_google_sheets(data):
-    """Save form data to Google Sheets using FINAL credentials"""
+def _build_oauth_credentials():
+    """Load credentials and parse the private key into a Credentials object"""
+    # Load credentials from EXACT path
+    credentials_dict = load_credentials()
+    if not credentials_dict:
+        return None
+    
+    service_email = credentials_dict.get('client_email', 'Unknown')
+    logger.debug("✅ Service Account: %s", service_email)
+    logger.debug("✅ Project: %s", credentials_dict.get('project_id', 'Unknown'))
+    
+    return Credentials.from_service_account_info(
+        credentials_dict, 
+        scopes=SHEETS_SCOPES
+    )
+
+def _ensure_headers_once(worksheet):
+    """Write the header row if the sheet is empty - runs once per process, not per submission"""
+    global _headers_initialized
+    if _headers_initialized:
+        return
+    if not worksheet.row_values(1):
+        logger.info("📝 Sheet is empty - writing header row")
+        worksheet.insert_row(SHEET_HEADERS, 1)
+    _headers_initialized = True
+
+@functools.lru_cache(maxsize=1)
+def _get_worksheet():
+    """Authorize gspread and open the sheet ONCE - reused by every submission"""
+    # Credentials are pre-parsed at boot - load lazily if that failed
+    creds = _OAUTH_CREDS or _build_oauth_credentials()
+    if creds is None:
+        raise RuntimeError("Could not load credentials")
+    
+    client = gspread.authorize(creds)
+    client.set_timeout(REQUEST_TIMEOUT)
+    
+    # Keep-alive pool to sheets.googleapis.com, with backoff on 429/5xx.
+    # Only idempotent methods are retried here - a failed append (POST)
+    # stays pending in the flusher and goes out with the next batch
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+    client.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    
+    # Open spreadsheet
+    logger.debug("🔓 Opening Google Sheet...")
+    spreadsheet = client.open_by_key(GOOGLE_SHEET_KEY)
+    worksheet = spreadsheet.sheet1
+    logger.debug("✅ Opened sheet: %s", worksheet.title)
+    _ensure_headers_once(worksheet)
+    return worksheet
+
+def _reset_worksheet():
+    """Drop the cached worksheet - the next _get_worksheet() reopens the sheet and re-checks headers"""
+    global _headers_initialized
+    _headers_initialized = False
+    _get_worksheet.cache_clear()
+
+def _flush_rows(rows):
+    """Write rows to Google Sheets with ONE append_rows call - returns a FLUSH_* outcome"""
+    global _OAUTH_CREDS
+    try:
+        logger.debug("📊 Flushing %s row(s) to Google Sheets...", len(rows))
+        
+        # Cached client + worksheet (built on first flush)
+        worksheet = _get_worksheet()
+        
+        # Append rows - reopen once if the token was rejected (401) or the
+        # sheet was renamed, deleted or swapped under us (400/404)
+        try:
+            worksheet.append_rows(rows, **SHEETS_APPEND_OPTIONS)
+        except gspread.exceptions.APIError as e:
+            status = e.response.status_code
+            if status not in (400, 401, 404):
+                raise
+            logger.warning("🔄 Sheets API %s on append - reopening worksheet", status)
+            _reset_worksheet()
+            _get_worksheet().append_rows(rows, **SHEETS_APPEND_OPTIONS)
+        logger.debug("✅ SUCCESS: Saved %s row(s) to Google Sheets!", len(rows))
+        return FLUSH_OK
+        
+    except RefreshError as e:
+        # Token refresh was refused (key revoked or rotated) - drop the cached
+        # client and credentials so the next flush rebuilds from the secret file
+        logger.error("❌ Token refresh failed: %s (%s row(s) kept for retry)", e, len(rows))
+        _OAUTH_CREDS = None
+        _parse_credentials.cache_clear()
+        _reset_worksheet()
+        return FLUSH_RETRY
+        
+    except Exception as e:
+        logger.exception("❌ GOOGLE SHEETS ERROR: %s (%s row(s) not saved)", type(e).__name__, len(rows))
+        
+        # Specific error handling - one lowercase conversion, first matching hint wins
+        message = str(e).lower()
+        for needle, (error, solution) in SHEETS_ERROR_HINTS.items():
+            if needle in message:
+                logger.error(error)
+                if needle == 'permission_denied':
+                    solution %= (load_credentials() or {}).get('client_email', 'service account')
+                logger.error(solution)
+                break
+        
+        # API errors are classified by status - timeouts / connection errors are retried
+        if isinstance(e, gspread.exceptions.APIError):
+            return flush_outcome(e.response.status_code)
+        return FLUSH_RETRY
+
+def backoff_delay(base, attempt, cap):
+    """Exponential backoff plus up to 1s of jitter - workers that failed together retry apart"""
+    return min(base * 2 ** attempt, cap) + random.random()
+
+def _collect_batch(q, pending, max_size, interval):
+    """Sleep until an item arrives, then collect more for up to `interval` s - True once the stop sentinel is seen"""
+    # Blocking get with no timeout - an idle worker never wakes up
+    item = q.get()
+    if item is None:
+        return True
+    pending.append(item)
+    
+    # Collect more items until the batch is full or the interval is up
+    deadline = time.monotonic() + interval
+    while len(pending) < max_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = q.get(timeout=remaining)
+        except Empty:
+            break
+        if item is None:
+            return True
+        pending.append(item)
+    return False
+
+def _drain_queue(q, pending):
+    """Move everything already queued into pending without waiting - True once the stop sentinel is seen"""
+    while True:
+        try:
+            item = q.get_nowait()
+        except Empty:
+            return False
+        if item is None:
+            return True
+        pending.append(item)
+
+def _sheets_flusher():
+    """Background thread - batch rows for up to SHEETS_FLUSH_INTERVAL s, flush with one append"""
+    pending = []
+    attempts = 0
+    stop = False
+    while not stop or pending:
+        # A batch being retried is not topped up - rows that arrive meanwhile
+        # wait in the queue, so a bad batch never takes healthy rows down with it
+        if not pending:
+            stop = _collect_batch(_row_queue, pending, SHEETS_FLUSH_SIZE, SHEETS_FLUSH_INTERVAL)
+            if not pending:
+                continue
+        
+        # On shutdown everything still queued goes out with this batch - one final append
+        if _flushers_stopping.is_set() and not stop:
+            stop = _drain_queue(_row_queue, pending)
+        
+        outcome = _flush_rows(pending)
+        if outcome == FLUSH_OK:
+            pending = []
+            attempts = 0
+            continue
+        
+        attempts += 1
+        if outcome == FLUSH_RETRY and attempts < SHEETS_MAX_ATTEMPTS and not _flushers_stopping.is_set():
+            # Back off on 429/5xx/timeouts
+            _flushers_stopping.wait(backoff_delay(SHEETS_FLUSH_INTERVAL, attempts, SHEETS_MAX_BACKOFF))
+            continue
+        
+        # Permanent error (400/403/404...), out of attempts or shutting down - log the
+        # rows so they can be re-entered, and on shutdown the rest of the queue with them
+        if _flushers_stopping.is_set() and not stop:
+            stop = _drain_queue(_row_queue, pending)
+        logger.error("❌ Dropping %s row(s) after %s attempt(s): %s", len(pending), attempts, pending)
+        pending = []
+        attempts = 0
+
+def _stop_flusher(thread, q):
+    """Flush remaining items on shutdown - None is the stop sentinel"""
+    _flushers_stopping.set()
+    q.put(None)
+    thread.join(timeout=FLUSHER_JOIN_TIMEOUT)
+
+def _start_flusher(name, target, q):
+    """Start a flusher thread on first use (after gunicorn has forked the worker)"""
+    with _flusher_lock:
+        if name not in _flusher_threads:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            _flusher_threads[name] = thread
+            atexit.register(_stop_flusher, thread, q)
+
+def save_to_google_sheets(data, now_iso=None):
+    """Buffer form data for Google Sheets - written in batches by the flusher thread"""
     if not SHEETS_AVAILABLE:
-        print("❌ Google Sheets library not available")
+        logger.error("❌ Google Sheets library not available")
         return False
     
     if not GOOGLE_SHEET_KEY:
-        print("❌ GOOGLE_SHEET_KEY not set")
+        logger.error("❌ GOOGLE_SHEET_KEY not set")
         return False
     
     try:
-        print("="*50)
-        print("📊 GOOGLE SHEETS SAVE ATTEMPT")
-        print("="*50)
-        print(f"📁 Credentials: {CREDENTIALS_FILE_PATH}")
-        print(f"🔑 Sheet ID: {GOOGLE_SHEET_KEY}")
-        print(f"⏰ Time: {datetime.now().isoformat()}")
-        
-        # Load credentials from EXACT path
-        credentials_dict = load_credentials()
-        if not credentials_dict:
-            print("❌ FAILED: Could not load credentials")
-            return False
-        
-        service_email = credentials_dict.get('client_email', 'Unknown')
-        print(f"✅ Service Account: {service_email}")
-        print(f"✅ Project: {credentials_dict.get('project_id', 'Unknown')}")
-        
-        # Setup Google Sheets
-        scope = ["https://www.googleapis.com/auth/spreadsheets"]
+        logger.debug("📊 GOOGLE SHEETS SAVE ATTEMPT")
+        logger.debug("📁 Credentials: %s", CREDENTIALS_FILE_PATH)
+        logger.debug("🔑 Sheet ID: %s", GOOGLE_SHEET_KEY)
         
-        creds = Credentials.from_service_account_info(
-            credentials_dict, 
-            scopes=scope
-        )
+        # Prepare data - one pass over the form keys, in column order
+        get = data.get
+        full_name, position, year, interests, comments = [get(field, '') for field in SHEET_ROW_FIELDS]
+        if isinstance(interests, str):
+            interests_str = interests  # test.sh / older forms send a plain string
+        else:
+            try:
+                interests_str = ', '.join(map(str, interests or ()))
+            except TypeError:
+                interests_str = str(interests)
         
-        client = gspread.authorize(creds)
+        row = [full_name, position, year, interests_str, comments, now_iso or iso_now()]
         
-        # Open spreadsheet
-        print(f"🔓 Opening Google Sheet...")
-        spreadsheet = client.open_by_key(GOOGLE_SHEET_KEY)
-        worksheet = spreadsheet.sheet1
-        print(f"✅ Opened sheet: {worksheet.title}")
+        logger.debug("📝 Data: %s...", row[:3])
         
-        # Prepare data
-        interests = data.get('interests', [])
-        if isinstance(interests, list):
-            interests_str = ', '.join(interests)
-        else:
-            interests_str = str(interests) if interests else ''
-        
-        row = [
-            data.get('fullName', ''),
-            data.get('desiredPosition', ''),
-            data.get('desiredYear', ''),
-            interests_str,
-            data.get('comments', ''),
-            datetime.now().isoformat()
-        ]
-        
-        print(f"📝 Data: {row[:3]}...")
-        
-        # Append row
-        worksheet.append_row(row)
-        print(f"✅ SUCCESS: Saved to Google Sheets!")
-        print(f"👤 User: {data.get('fullName', 'Unknown')}")
-        print(f"📧 Email: {data.get('email', 'No email')}")
-        print("="*50)
+        # Buffer row - flushed every SHEETS_FLUSH_INTERVAL s or at SHEETS_FLUSH_SIZE rows
+        _start_flusher('sheets-flusher', _sheets_flusher, _row_queue)
+        _row_queue.put(row)
+        logger.debug("✅ SUCCESS: Buffered for Google Sheets (%s pending)", _row_queue.qsize())
         return True
         
     except Exception as e:
-        print(f"❌ GOOGLE SHEETS ERROR: {type(e).__name__}")
-        print(f"❌ Details: {str(e)[:200]}")
-        
-        # Specific error handling
-        if 'invalid_grant' in str(e):
-            print("🔑 ERROR: Invalid JWT Signature")
-            print("💡 Solution: Regenerate credentials or check time sync")
-        elif 'PERMISSION_DENIED' in str(e):
-            print("🔑 ERROR: Permission denied")
-            print(f"💡 Solution: Share sheet with: {credentials_dict.get('client_email', 'service account')}")
-        elif 'not found' in str(e).lower():
-            print("🔑 ERROR: Sheet not found")
-            print("💡 Solution: Check GOOGLE_SHEET_KEY environment variable")
-        
-        import traceback
-        traceback.print_exc()
+        logger.error("❌ GOOGLE SHEETS ERROR: %s", type(e).__name__)
+        logger.error("❌ Details: %s", str(e)[:200])
         return False
 
+# Recycle the pooled connection every N API calls so a long-lived worker
+# does not stay pinned to one Resend edge / stale DNS answer forever
+RESEND_SESSION_MAX_REQUESTS = int(os.getenv("RESEND_SESSION_MAX_REQUESTS", "100"))  # <= 0: never recycle
+_resend_request_count = itertools.count(1)  # next() is atomic under the GIL
+
+@functools.lru_cache(maxsize=1)
+def _get_resend_session():
+    """Keep-alive HTTP session to the Resend API - one TLS connection reused across emails"""
+    session = requests.Session()
+    session.headers.update({
+        "Accept": "application/json",
+        "Authorization": f"Bearer {RESEND_API_KEY}",
+        "User-Agent": f"resend-python:{resend.get_version()}"
+    })
+    return session
+
+def _close_resend_session():
+    """Close the pooled Resend connection if one was opened - the next send reconnects"""
+    if _get_resend_session.cache_info().currsize:
+        _get_resend_session().close()
+        _get_resend_session.cache_clear()
+
+# Registered at import so it runs after the flushers' atexit hooks (LIFO)
+atexit.register(_close_resend_session)
+
+def _email_payload(to_email, name):
+    """Resend payload for one confirmation email"""
+    html = EMAIL_HTML_STATIC or EMAIL_TEMPLATE.safe_substitute(name=escape(name))
+    return dict(EMAIL_PAYLOAD_BASE, to=to_email, html=html)
+
+def _resend_post(path, payload):
+    """POST to the Resend API on the pooled connection - returns the decoded JSON body"""
+    url = f"{resend.api_url}{path}"
+    if RESEND_SESSION_MAX_REQUESTS > 0 and next(_resend_request_count) % RESEND_SESSION_MAX_REQUESTS == 0:
+        logger.debug("♻️ Recycling Resend connection")
+        _close_resend_session()
+    try:
+        resp = _get_resend_session().post(url, json=payload, timeout=REQUEST_TIMEOUT)
+    except requests.ConnectionError:
+        # Kept-alive connection was dropped - reconnect once
+        logger.warning("🔌 Resend connection dropped - reconnecting")
+        _close_resend_session()
+        resp = _get_resend_session().post(url, json=payload, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
 def send_email_resend(to_email, name):
     """Send email via Resend API (FAST - <1 second)"""
     if not RESEND_AVAILABLE:
-        print("❌ Resend library not available")
+        logger.error("❌ Resend library not available")
         return False
     
     if not RESEND_API_KEY:
-        print("❌ RESEND_API_KEY not set")
+        logger.error("❌ RESEND_API_KEY not set")
         return False
     
     try:
-        print(f"⚡ Resend email to {to_email}...")
-        
-        subject = "本日のブース訪問、ありがとうございます / Thanks for visiting our booth today!"
-        
-        html_content = f"""
-        <div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-            <div style="margin-bottom: 30px;">
-                <h2 style="color: #333; margin-bottom: 15px;">本日のブース訪問、ありがとうございます。</h2>
-                
-                <p>貴方のご回答、確かに拝見しました。</p>
-                <p>担当者より改めてご連絡いたします。</p>
-                
-                <p style="margin-top: 20px;">私たちは日本で、決して止まってはいけない社会インフラを支える通信技術に取り組んでいます。</p>
-                
-                <p>日本で学び、経験を積み、将来その力をタイで活かしたい方との出会いを楽しみにしています。</p>
-                
-                <div style="margin-top: 30px;">
-                    <p style="margin-bottom: 5px;"><strong>CEO 十河元太郎</strong></p>
-                    <p style="margin-bottom: 5px;"><strong>協和テクノロジィズ株式会社</strong></p>
-                    <p style="margin-bottom: 5px;">採用専用メールアドレス: <a href="mailto:r-hirata@star.kyotec.co.jp">r-hirata@star.kyotec.co.jp</a></p>
-                </div>
-            </div>
-            
-            <hr style="margin: 30px 0; border: none; border-top: 1px solid #ddd;">
-            
-            <div>
-                <h2 style="color: #333; margin-bottom: 15px;">Dear All,</h2>
-                
-                <p><strong>Thanks for visiting our booth today!</strong></p>
-                <p><strong>we'll be in touch soon!</strong></p>
-                
-                <p style="margin-top: 20px;">Our mission is engineering the critical communication technologies that keep essential infrastructure running in Japan.</p>
-                
-                <p><strong>Join us in Japan and grow with us!</strong></p>
-                <p><strong>We guide you and we learn together!</strong></p>
-                
-                <div style="margin-top: 30px;">
-                    <p style="margin-bottom: 5px;">Yours sincerely,</p>
-                    <p style="margin-bottom: 5px;"><strong>Gentaro Sogo</strong></p>
-                    <p style="margin-bottom: 5px;"><strong>CEO Kyowa Technologies Co., Ltd.</strong></p>
-                    <p style="margin-bottom: 5px;">Continued contact: <a href="mailto:r-hirata@star.kyotec.co.jp">r-hirata@star.kyotec.co.jp</a></p>
-                </div>
-            </div>
-        </div>
-        """
-        
-        # Send via Resend API
-        r = resend.Emails.send({
-            "from": "Kyowa Technologies <onboarding@resend.dev>",
-            "to": to_email,
-            "subject": subject,
-            "html": html_content
-        })
-        
-        print(f"✅ Resend email sent in <1s! ID: {r['id']}")
+        logger.debug("⚡ Resend email to %s...", to_email)
+        r = _resend_post("/emails", _email_payload(to_email, name))
+        logger.debug("✅ Resend email sent in <1s! ID: %s", r['id'])
         return True
         
     except Exception as e:
-        print(f"❌ Resend API error: {type(e).__name__}: {e}")
+        logger.error("❌ Resend API error: %s: %s", type(e).__name__, e)
         return False
 
+def send_email_batch(recipients):
+    """Send several confirmation emails with ONE Resend /emails/batch call - returns a FLUSH_* outcome"""
+    try:
+        logger.debug("⚡ Resend batch of %s email(s)...", len(recipients))
+        r = _resend_post("/emails/batch", [_email_payload(to_email, name) for to_email, name in recipients])
+        logger.debug("✅ Resend batch sent: %s email(s)", len(r.get('data') or ()))
+        return FLUSH_OK
+        
+    except Exception as e:
+        logger.error("❌ Resend batch error: %s: %s (%s email(s))", type(e).__name__, e, len(recipients))
+        
+        # HTTP errors are classified by status. Only a failed connect (ConnectionError,
+        # incl. ConnectTimeout) is retried blind - a ReadTimeout or anything else means
+        # the batch may already have been delivered, and resending would duplicate it
+        response = getattr(e, 'response', None)
+        if response is not None:
+            return flush_outcome(response.status_code)
+        if isinstance(e, requests.ConnectionError):
+            return FLUSH_RETRY
+        return FLUSH_FAILED
+
+# CORS - only /submit is called cross-origin, so its headers are added there
+# instead of by an app-wide middleware. Preflight carries a one-day Max-Age
+# so browsers stop re-sending OPTIONS
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+PREFLIGHT_HEADERS = dict(CORS_HEADERS, **{
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Max-Age': '86400'
+})
+
+def with_cors(view):
+    """Add CORS_HEADERS to every response from view"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = app.make_response(view(*args, **kwargs))
+        response.headers.update(CORS_HEADERS)
+        return response
+    return wrapper
+
+# Durable email queue - used when Celery is installed and REDIS_URL is set
+# Worker: celery -A app.celery worker -Q email_queue --pool=gevent --concurrency=10 --prefetch-multiplier=10
+celery = None
+if CELERY_AVAILABLE and REDIS_URL:
+    celery = Celery('forms', broker=REDIS_URL)
+    celery.conf.task_routes = {'forms.send_confirmation_email': {'queue': 'email_queue'}}
+    logger.info("✅ Celery email queue enabled (broker: %s)", REDIS_URL.split('@')[-1])
+
+    @celery.task(name='forms.send_confirmation_email', bind=True, max_retries=3)
+    def send_confirmation_email_task(self, to_email, name):
+        """Send confirmation email from the Celery worker - retried on failure"""
+        if not send_email_resend(to_email, name):
+            raise self.retry(countdown=30)
+        return True
+
+# In-process email batching - used when there is no Celery broker, keeps /submit off the Resend RTT
+EMAIL_MAX_ATTEMPTS = 3
+EMAIL_FLUSH_INTERVAL = float(os.getenv("EMAIL_FLUSH_INTERVAL", "2"))  # seconds
+EMAIL_FLUSH_SIZE = min(int(os.getenv("EMAIL_FLUSH_SIZE", "50")), 100)  # Resend batch limit is 100
+_email_queue = SimpleQueue()
+
+def _deliver_emails(recipients):
+    """Send one batch, backing off on 429/5xx - a rejected batch (400/422) is split so only bad addresses are lost"""
+    for attempt in range(1, EMAIL_MAX_ATTEMPTS + 1):
+        outcome = send_email_batch(recipients)
+        if outcome == FLUSH_OK:
+            return
+        if outcome != FLUSH_RETRY or attempt == EMAIL_MAX_ATTEMPTS:
+            break
+        _flushers_stopping.wait(backoff_delay(1, attempt, 32))
+    
+    if outcome == FLUSH_REJECTED and len(recipients) > 1:
+        middle = len(recipients) // 2
+        _deliver_emails(recipients[:middle])
+        _deliver_emails(recipients[middle:])
+        return
+    logger.error("❌ %s email(s) dropped after %s attempt(s): %s",
+                 len(recipients), attempt, [to_email for to_email, _ in recipients])
+
+def _email_flusher():
+    """Background thread - batch emails for up to EMAIL_FLUSH_INTERVAL s, send with one call"""
+    stop = False
+    while not stop:
+        pending = []
+        stop = _collect_batch(_email_queue, pending, EMAIL_FLUSH_SIZE, EMAIL_FLUSH_INTERVAL)
+        if pending:
+            _deliver_emails(pending)
+
+# /submit field caps - longer values are truncated, unknown keys are dropped
+SUBMIT_FIELD_LIMITS = {
+    'fullName': 200,
+    'desiredPosition': 200,
+    'desiredYear': 20,
+    'interests': 200,  # per item when sent as a list
+    'comments': 2000
+}
+MAX_INTERESTS = 20
+MAX_EMAIL_LENGTH = 254  # RFC 5321 - longer addresses are rejected, not truncated
+
+def clean_submission(data):
+    """Known form fields only, capped to SUBMIT_FIELD_LIMITS - email is stripped but never truncated"""
+    cleaned = {'email': str(data.get('email') or '').strip()}
+    for field, limit in SUBMIT_FIELD_LIMITS.items():
+        value = data.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)):
+            cleaned[field] = value  # desiredYear may arrive as a number
+        elif field == 'interests' and isinstance(value, list):
+            cleaned[field] = [str(item)[:limit] for item in value[:MAX_INTERESTS]]
+        else:
+            cleaned[field] = str(value)[:limit]
+    return cleaned
+
+# Idempotency for double-clicks / network retries - recently accepted submissions by digest
+DEDUPE_WINDOW = 60  # seconds
+DEDUPE_MAX_ENTRIES = 10000
+_recent_submissions = OrderedDict()  # digest -> [monotonic time, (first response, status) or None], oldest first
+_recent_lock = threading.Lock()
+
+def submission_key(email, name, comments):
+    """Digest identifying a submission - email is case-insensitive, comments are capped at 64 chars"""
+    return hashlib.blake2b(f"{email.lower()}\0{name}\0{comments[:64]}".encode(), digest_size=16).digest()
+
+def claim_submission(key):
+    """(True, None) and record the key if it is new, else (False, (first response, status) - None while in flight)"""
+    now = time.monotonic()
+    with _recent_lock:
+        # Evict from the old end - expired entries, or the oldest once the map is full
+        while _recent_submissions:
+            oldest = next(iter(_recent_submissions.values()))[0]
+            if now - oldest < DEDUPE_WINDOW and len(_recent_submissions) < DEDUPE_MAX_ENTRIES:
+                break
+            _recent_submissions.popitem(last=False)
+        entry = _recent_submissions.get(key)
+        if entry is not None:
+            return False, entry[1]
+        _recent_submissions[key] = [now, None]
+        return True, None
+
+def record_response(key, response, status):
+    """Store the accepted response and its status for a claimed key - replayed to duplicates within DEDUPE_WINDOW"""
+    with _recent_lock:
+        entry = _recent_submissions.get(key)
+        if entry is not None:
+            entry[1] = (response, status)
+
+def release_submission(key):
+    """Forget a claimed key after a failed submission so the retry goes through"""
+    with _recent_lock:
+        _recent_submissions.pop(key, None)
+
 @app.route('/submit', methods=['POST', 'OPTIONS'])
+@with_cors
 def submit_form():
     """Handle form submission - RESEND API VERSION"""
     if request.method == 'OPTIONS':
-        return '', 200
+        return '', 204, PREFLIGHT_HEADERS
     
-    print("\n" + "="*60)
-    print("📝 FORM SUBMISSION - RESEND API (FAST EMAIL)")
-    print("="*60)
+    logger.debug("📝 FORM SUBMISSION - RESEND API (FAST EMAIL)")
     
+    submission = None
     try:
-        data = request.json
-        if not data:
+        # Parse the raw body directly - no get_json content-type dance, body not kept on the request
+        try:
+            data = json_loads(request.get_data(cache=False))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
+        except RequestEntityTooLarge:
+            return jsonify({'success': False, 'error': 'Payload too large'}), 413
+        if not data or not isinstance(data, dict):
             return jsonify({'success': False, 'error': 'No data'}), 400
+        data = clean_submission(data)
+        
+        # Extract the recipient once - shared by validation, the log lines and the email queue
+        email = data['email']
+        name = str(data.get('fullName', '')).strip()
+        logger.debug("👤 Name: %s", name)
+        logger.debug("📧 Email: %s", email)
+        
+        # Reject incomplete and repeated submissions before any Sheets/Resend work
+        missing = [field for field, value in (('fullName', name), ('email', email)) if not value]
+        if missing:
+            return jsonify({'success': False, 'error': 'Missing required fields', 'missing': missing}), 400
+        if len(email) > MAX_EMAIL_LENGTH or '@' not in email:
+            return jsonify({'success': False, 'error': 'Invalid email'}), 400
+        submission = submission_key(email, name, str(data.get('comments', '')))
+        is_new, first_response = claim_submission(submission)
+        if not is_new:
+            logger.info("🔁 Duplicate submission from %s ignored", email)
+            if first_response is None:
+                first_response = ({'success': True, 'queued': False, 'message': 'Form already submitted'}, 200)
+            body, status = first_response
+            return jsonify(dict(body, duplicate=True)), status
         
-        print(f"👤 Name: {data.get('fullName', 'Unknown')}")
-        print(f"📧 Email: {data.get('email', 'No email')}")
+        # One timestamp per submission - shared by the sheet row and the response
+        now_iso = iso_now()
         
-        # Save to Google Sheets (synchronous - should be fast)
-        sheets_success = False
-        if GOOGLE_SHEET_KEY and SHEETS_AVAILABLE:
-            sheets_success = save_to_google_sheets(data)
+        # Save to Google Sheets (buffered - written in batches in the background)
+        # (sheets_saved stays False: the append happens after the response)
+        sheets_saved = False
+        sheets_queued = False
+        if SHEETS_ENABLED:
+            sheets_queued = save_to_google_sheets(data, now_iso)
         else:
-            print("⚠️ Google Sheets: Not configured")
+            logger.debug("⚠️ Google Sheets: Not configured")
         
-        # Send email via Resend API (FAST - <1 second)
+        # Send email via Resend API - queued to Celery worker or the in-process batcher
+        # (email_sent stays False: the send completes after the response)
         email_sent = False
-        email = data.get('email', '')
-        name = data.get('fullName', 'User')
-        
-        if email:
-            if RESEND_API_KEY and RESEND_AVAILABLE:
-                email_sent = send_email_resend(email, name)
-                print(f"📧 Email sent via Resend: {email_sent}")
-            else:
-                print("⚠️ Email: Resend API not configured")
+        email_queued = False
+        
+        if EMAIL_ENABLED and celery:
+            send_confirmation_email_task.delay(email, name)
+            email_queued = True
+            logger.debug("📧 Email queued for Celery worker")
+        elif EMAIL_ENABLED:
+            _start_flusher('email-flusher', _email_flusher, _email_queue)
+            _email_queue.put((email, name))
+            email_queued = True
+            logger.debug("📧 Email queued for batched send")
         else:
-            print("⚠️ Email: No address provided")
+            logger.debug("⚠️ Email: Resend API not configured")
         
-        # Immediate response
+        # Immediate response - nothing above waited on Sheets or Resend
+        queued = sheets_queued or email_queued
         response = {
             'success': True,
+            'queued': queued,
             'message': 'Form submitted successfully!',
-            'sheets_saved': sheets_success,
+            'sheets_saved': sheets_saved,
+            'sheets_queued': sheets_queued,
             'email_sent': email_sent,
-            'email_provider': 'Resend API' if email_sent else 'None',
-            'timestamp': datetime.now().isoformat(),
+            'email_queued': email_queued,
+            'email_provider': 'Resend API' if email_sent or email_queued else 'None',
+            'timestamp': now_iso,
             'version': 'RESEND-API-FAST',
             'credentials_file': 'nortiq-forms-65b5a63e6217.json'
         }
         
-        print(f"✅ Response: {response}")
-        print("="*60)
-        
-        return jsonify(response), 200
+        # 202 Accepted - Sheets row and email are handled in the background
+        status = 202 if queued else 200
+        logger.info("✅ Response: %s", response)
+        record_response(submission, response, status)
+        return jsonify(response), status
         
     except Exception as e:
-        print(f"❌ Server error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Server error: %s", e)
+        if submission is not None:
+            release_submission(submission)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Parse the service account key and open the worksheet at import, not on the first submission
+if SHEETS_AVAILABLE and (credentials_file_exists() or GOOGLE_CREDENTIALS_JSON):
+    try:
+        _OAUTH_CREDS = _build_oauth_credentials()
+    except Exception as e:
+        logger.error("❌ Boot-time credentials load failed - will retry lazily: %s", e)
+    
+    if _OAUTH_CREDS and GOOGLE_SHEET_KEY:
+        try:
+            _get_worksheet()
+        except Exception as e:
+            logger.error("❌ Boot-time worksheet open failed - will retry lazily: %s", e)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 10000))
-    print("\n" + "="*60)
-    print("🚀 FORM BACKEND - RESEND API VERSION (FAST EMAIL)")
-    print("="*60)
-    print(f"📍 Port: {port}")
-    print(f"🔑 Resend API: {'✅ CONFIGURED' if RESEND_API_KEY else '❌ NOT SET'}")
-    if RESEND_API_KEY:
-        print(f"   Key: {RESEND_API_KEY[:15]}...")
-    print(f"📚 Resend Lib: {'✅ AVAILABLE' if RESEND_AVAILABLE else '❌ MISSING - pip install resend'}")
-    print(f"📊 Sheets Key: {'✅ SET' if GOOGLE_SHEET_KEY else '❌ NOT SET'}")
-    print(f"📁 Credentials: {CREDENTIALS_FILE_PATH}")
-    print(f"📁 File Exists: {'✅ YES' if os.path.exists(CREDENTIALS_FILE_PATH) else '❌ NO - Upload to Render Secret Files'}")
-    print(f"📚 Sheets Lib: {'✅ AVAILABLE' if SHEETS_AVAILABLE else '❌ MISSING'}")
-    print("="*60)
-    print("💡 Upload credentials to Render → Environment → Secret Files")
-    print(f"💡 Mount Path: {CREDENTIALS_FILE_PATH}")
-    print("="*60)
+    logger.info(
+        "🚀 Backend start port=%d email=%s sheets=%s sheets_lib=%s creds_file=%s email_queue=%s env=%s",
+        port, EMAIL_ENABLED, SHEETS_ENABLED, SHEETS_AVAILABLE, credentials_file_exists(),
+        'celery' if celery else 'batch', 'Render' if os.getenv('RENDER') else 'Local'
+    )
+    
+    # Werkzeug's dev server is for local runs only - on Render hand over to gunicorn
+    if os.getenv('RENDER'):
+        logger.info("🦄 Render detected - starting gunicorn (gunicorn_config.py)")
+        # Drain queued records now - exec replaces the process without running atexit
+        atexit.unregister(_log_listener.stop)
+        _log_listener.stop()
+        os.execvp('gunicorn', ['gunicorn', 'app:app', '--config', 'gunicorn_config.py'])
     
-    app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
\ No newline at end of file
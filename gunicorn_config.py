@@ -9,13 +9,25 @@ import os
 bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
 backlog = 2048
 
-# Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
+# Worker processes - gevent if installed (the worker monkey-patches sockets so
+# Resend/Sheets calls yield), otherwise threaded so their I/O still overlaps
+try:
+    import gevent  # noqa: F401
+    GEVENT_AVAILABLE = True
+except ImportError:
+    GEVENT_AVAILABLE = False
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gevent" if GEVENT_AVAILABLE else "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_connections = 500
 timeout = 30
 keepalive = 2
 
+# app.py opens its Sheets/Resend sessions and flusher threads at import -
+# leave preload off so every worker builds its own after the fork
+preload_app = False
+
 # Logging
 accesslog = "-"
 errorlog = "-"